@@ -1,5 +1,6 @@
 import asyncio
 import json
+import re
 import uuid
 from datetime import datetime
 
@@ -9,6 +10,10 @@ import httpx
 BASE_URL = "http://localhost:8000"
 API_KEY = "your_api_key_here"  # Replace with your API key
 
+# HTML tags found in direction step instructions
+HTML_TAG_RE = re.compile(r"</?b>|</?div>")
+HTML_TAG_REPLACEMENTS = {"<b>": "", "</b>": "", "<div>": " ", "</div>": ""}
+
 async def main():
     """Example A2A client for Google Maps A2A server"""
     async with httpx.AsyncClient() as client:
@@ -22,12 +27,13 @@ async def main():
         
         # 2. Create a geocoding task
         print("Creating geocoding task...")
+        now = datetime.now().isoformat()
         task_data = {
-            "id": str(uuid.uuid4()),
+            "id": uuid.uuid4().hex,
             "type": "geocode",
             "status": "created",
-            "created_at": datetime.now().isoformat(),
-            "updated_at": datetime.now().isoformat(),
+            "created_at": now,
+            "updated_at": now,
             "input": {
                 "format": "text",
                 "content": "1600 Amphitheatre Parkway, Mountain View, CA"
@@ -76,12 +82,13 @@ async def main():
         
         # 5. Create a directions task
         print("Creating directions task...")
+        now = datetime.now().isoformat()
         directions_task = {
-            "id": str(uuid.uuid4()),
+            "id": uuid.uuid4().hex,
             "type": "directions",
             "status": "created",
-            "created_at": datetime.now().isoformat(),
-            "updated_at": datetime.now().isoformat(),
+            "created_at": now,
+            "updated_at": now,
             "input": {
                 "format": "application/json",
                 "content": {
@@ -137,8 +144,7 @@ async def main():
                     for i, step in enumerate(steps[:3]):  # First 3 steps
                         instruction = step.get("html_instructions", "")
                         # Remove HTML tags for better readability
-                        instruction = instruction.replace("<b>", "").replace("</b>", "")
-                        instruction = instruction.replace("<div>", " ").replace("</div>", "")
+                        instruction = HTML_TAG_RE.sub(lambda m: HTML_TAG_REPLACEMENTS[m.group(0)], instruction)
                         print(f"  {i+1}. {instruction}")
                     
                     if len(steps) > 3:
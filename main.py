@@ -1,19 +1,59 @@
+import asyncio
+import hashlib
 import os
+import re
 import uuid
 import json
+from contextlib import asynccontextmanager
 from datetime import datetime
 from enum import Enum
-from typing import Dict, List, Optional, Any, Union
+from typing import Awaitable, Callable, Dict, List, Optional, Any, Tuple, Union
 
 import httpx
-from fastapi import FastAPI, HTTPException, Depends, Header, Request, Body
+import orjson
+from cachetools import TTLCache
+from fastapi import FastAPI, HTTPException, Depends, Header, Request, Body, Response
+from fastapi.exceptions import RequestValidationError
 from fastapi.security import APIKeyHeader
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
+from fastapi.middleware.gzip import GZipMiddleware
+from pydantic import BaseModel, ConfigDict, Field, ValidationError, field_serializer, model_validator
+from pydantic.json_schema import SkipJsonSchema
+from pydantic_core import PydanticUndefined
+
+# Environment variables (in a production environment, use proper env variable management)
+API_KEY = os.getenv("API_KEY", "default_api_key")  # Default for development
+GOOGLE_MAPS_API_KEY = os.getenv("GOOGLE_MAPS_API_KEY", "your_google_maps_api_key_here")
+TASK_STORE_MAXSIZE = int(os.getenv("TASK_STORE_MAXSIZE", "10000"))
+TASK_STORE_TTL = int(os.getenv("TASK_STORE_TTL", "3600"))  # Seconds
+MAPS_CACHE_MAXSIZE = int(os.getenv("MAPS_CACHE_MAXSIZE", "50000"))
+MAPS_CACHE_TTL = int(os.getenv("MAPS_CACHE_TTL", "86400"))  # Seconds
+
+# Shared Google Maps API client
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open one pooled HTTP/2 client for the app's lifetime so requests reuse connections"""
+    app.state.google_maps_client = httpx.AsyncClient(
+        base_url="https://maps.googleapis.com/maps/api",
+        params={"key": GOOGLE_MAPS_API_KEY},
+        http2=True,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+        timeout=30.0
+    )
+    yield
+    await app.state.google_maps_client.aclose()
 
 # Initialize FastAPI app
-app = FastAPI(title="Google Maps A2A Server")
+# Responses are serialized with orjson; endpoints return ORJSONResponse directly
+# so FastAPI skips the jsonable_encoder pass
+app = FastAPI(
+    title="Google Maps A2A Server",
+    default_response_class=ORJSONResponse,
+    # Task is documented once, as the create_task body and response
+    separate_input_output_schemas=False,
+    lifespan=lifespan
+)
 
 # Add CORS middleware to allow cross-origin requests
 app.add_middleware(
@@ -24,9 +64,8 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Environment variables (in a production environment, use proper env variable management)
-API_KEY = os.getenv("API_KEY", "default_api_key")  # Default for development
-GOOGLE_MAPS_API_KEY = os.getenv("GOOGLE_MAPS_API_KEY", "your_google_maps_api_key_here")
+# Compress larger responses such as passed-through directions and places JSON
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
 
 # Simple API key security
 api_key_header = APIKeyHeader(name="X-API-Key")
@@ -53,21 +92,50 @@ class TaskInput(BaseModel):
     format: InputFormat
     content: Union[str, Dict[str, Any]]
 
+# Outputs are produced by our own handlers, so they are built with
+# TaskOutput.model_construct() to skip re-validating Google Maps payloads
 class TaskOutput(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+    
     format: OutputFormat
-    content: Union[str, Dict[str, Any]]
+    # A Fragment holds Google Maps JSON passed through as raw bytes; orjson
+    # embeds it in the response as-is instead of re-encoding a parsed copy
+    content: Union[str, Dict[str, Any], SkipJsonSchema[orjson.Fragment]]
+    
+    @field_serializer("content", when_used="json")
+    def serialize_content(self, content: Any) -> Any:
+        """pydantic can't encode a Fragment, so decode its JSON for model_dump_json()"""
+        if isinstance(content, orjson.Fragment):
+            return orjson.loads(orjson.dumps(content))
+        return content
 
 class Task(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    id: str = Field(default_factory=lambda: uuid.uuid4().hex)
     type: str
     status: TaskStatus = TaskStatus.CREATED
     created_at: str = Field(default_factory=lambda: datetime.now().isoformat())
-    updated_at: str = Field(default_factory=lambda: datetime.now().isoformat())
+    # Filled from created_at when omitted or null, see default_updated_at
+    updated_at: Optional[str] = None
     input: TaskInput
     output: Optional[TaskOutput] = None
+    
+    @model_validator(mode="after")
+    def default_updated_at(self):
+        """A new task was last updated when it was created, so reuse that timestamp"""
+        if self.updated_at is None:
+            self.updated_at = self.created_at
+        return self
+
+# In-memory database for tasks, bounded in size and age so finished tasks
+# don't accumulate forever; the least recently used task is evicted first
+tasks_db: TTLCache = TTLCache(maxsize=TASK_STORE_MAXSIZE, ttl=TASK_STORE_TTL)
 
-# In-memory database for tasks
-tasks_db: Dict[str, Task] = {}
+# Successful Google Maps lookups keyed by (path, encoded query); geocoding
+# and place details are stable for hours, so repeats skip the HTTP round-trip
+maps_cache: TTLCache = TTLCache(maxsize=MAPS_CACHE_MAXSIZE, ttl=MAPS_CACHE_TTL)
+# The pending request for each key, so concurrent identical lookups (including
+# ones that fail and are never cached) share a single upstream call
+maps_inflight: Dict[Tuple[str, str], asyncio.Future] = {}
 
 # Agent Card for capability discovery
 AGENT_CARD = {
@@ -129,6 +197,20 @@ AGENT_CARD = {
     ]
 }
 
+# The agent card never changes at runtime, so it is serialized once and
+# served with an ETag that lets clients revalidate with If-None-Match. The tag
+# is weak because GZipMiddleware may send the same card as different bytes
+AGENT_CARD_BYTES = orjson.dumps(AGENT_CARD)
+AGENT_CARD_ETAG = f'W/"{hashlib.sha256(AGENT_CARD_BYTES).hexdigest()[:16]}"'
+AGENT_CARD_HEADERS = {"ETag": AGENT_CARD_ETAG, "Cache-Control": "public, max-age=3600"}
+
+# Largest batch accepted by PUT /tasks/batch-execute; kept well below the
+# Google Maps client's 100-connection pool so a batch can't exhaust it
+BATCH_EXECUTE_MAX_TASKS = 50
+
+# Task types accepted by POST /tasks, derived once from the agent card
+SUPPORTED_TASK_TYPES = frozenset(t["type"] for t in AGENT_CARD["tasks"])
+
 # Authentication dependency
 async def verify_api_key(api_key: str = Depends(api_key_header)):
     if api_key != API_KEY:
@@ -136,43 +218,91 @@ async def verify_api_key(api_key: str = Depends(api_key_header)):
     return api_key
 
 # Google Maps API Client
-async def google_maps_client():
-    """Create an HTTP client for Google Maps API requests"""
-    async with httpx.AsyncClient(
-        base_url="https://maps.googleapis.com/maps/api",
-        params={"key": GOOGLE_MAPS_API_KEY}
-    ) as client:
-        yield client
+async def google_maps_client(request: Request) -> httpx.AsyncClient:
+    """Return the shared HTTP client for Google Maps API requests"""
+    return request.app.state.google_maps_client
+
+# Task validation
+def body_validation_errors(error: ValidationError) -> List[Dict[str, Any]]:
+    """Turn a Task ValidationError into JSON-safe 422 entries located under the body"""
+    errors = []
+    # error.json() renders input/ctx values in JSON-safe form; errors() still
+    # tells which entries have no input at all
+    for raw, safe in zip(error.errors(include_url=False), orjson.loads(error.json(include_url=False))):
+        safe["loc"] = ["body", *safe["loc"]]
+        if raw.get("input") is PydanticUndefined:
+            safe.pop("input", None)
+        errors.append(safe)
+    return errors
+
+def validate_task_type(task_type: str):
+    """Reject task types that are not advertised in the agent card"""
+    if task_type not in SUPPORTED_TASK_TYPES:
+        supported_tasks = [t["type"] for t in AGENT_CARD["tasks"]]
+        raise HTTPException(status_code=400, detail=f"Unsupported task type. Must be one of: {supported_tasks}")
 
 # Route Handlers
 @app.get("/")
 async def root():
     """Root endpoint with basic server information"""
-    return {"message": "Google Maps A2A Server", "version": "1.0.0"}
+    return ORJSONResponse({"message": "Google Maps A2A Server", "version": "1.0.0"})
 
 @app.get("/agent-card")
-async def get_agent_card():
+async def get_agent_card(if_none_match: Optional[str] = Header(None)):
     """Return the agent card for capability discovery"""
-    return AGENT_CARD
+    if if_none_match:
+        # If-None-Match uses weak comparison, so the tag matches with or without W/
+        tags = {tag.strip() for tag in if_none_match.split(",")}
+        if tags & {"*", AGENT_CARD_ETAG, AGENT_CARD_ETAG[2:]}:
+            return Response(status_code=304, headers=AGENT_CARD_HEADERS)
+    return Response(content=AGENT_CARD_BYTES, media_type="application/json", headers=AGENT_CARD_HEADERS)
 
-@app.post("/tasks", dependencies=[Depends(verify_api_key)])
-async def create_task(task: Task):
+@app.post(
+    "/tasks",
+    dependencies=[Depends(verify_api_key)],
+    response_model=Task,
+    # The body is read raw below, so document it as a Task explicitly
+    openapi_extra={"requestBody": {
+        "required": True,
+        "content": {"application/json": {"schema": {"$ref": "#/components/schemas/Task"}}}
+    }}
+)
+async def create_task(request: Request):
     """Create a new task"""
-    # Validate task type against supported types
-    supported_tasks = [t["type"] for t in AGENT_CARD["tasks"]]
-    if task.type not in supported_tasks:
-        raise HTTPException(status_code=400, detail=f"Unsupported task type. Must be one of: {supported_tasks}")
+    # Validate straight from the JSON bytes rather than decoding to dicts first
+    try:
+        task = Task.model_validate_json(await request.body())
+    except ValidationError as e:
+        raise RequestValidationError(body_validation_errors(e)) from e
+    
+    validate_task_type(task.type)
     
     # Save task to database
     tasks_db[task.id] = task
-    return task
+    return ORJSONResponse(task.model_dump())
 
 @app.get("/tasks/{task_id}", dependencies=[Depends(verify_api_key)])
 async def get_task(task_id: str):
     """Get a task by ID"""
-    if task_id not in tasks_db:
+    task = tasks_db.get(task_id)
+    if task is None:
         raise HTTPException(status_code=404, detail="Task not found")
-    return tasks_db[task_id]
+    return ORJSONResponse(task.model_dump())
+
+@app.put("/tasks/batch-execute", dependencies=[Depends(verify_api_key)])
+async def batch_execute_tasks(
+    task_ids: List[str] = Body(..., max_length=BATCH_EXECUTE_MAX_TASKS),
+    client: httpx.AsyncClient = Depends(google_maps_client)
+):
+    """Execute several tasks concurrently and return them in request order"""
+    # Each task is executed once even if its ID is repeated
+    tasks = {task_id: tasks_db.get(task_id) for task_id in dict.fromkeys(task_ids)}
+    missing = [task_id for task_id, task in tasks.items() if task is None]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Tasks not found: {missing}")
+    
+    await asyncio.gather(*(run_task(task, client) for task in tasks.values()))
+    return ORJSONResponse([tasks[task_id].model_dump() for task_id in task_ids])
 
 @app.put("/tasks/{task_id}/execute", dependencies=[Depends(verify_api_key)])
 async def execute_task(
@@ -180,36 +310,32 @@ async def execute_task(
     client: httpx.AsyncClient = Depends(google_maps_client)
 ):
     """Execute a task by ID"""
-    if task_id not in tasks_db:
+    task = tasks_db.get(task_id)
+    if task is None:
         raise HTTPException(status_code=404, detail="Task not found")
     
-    task = tasks_db[task_id]
+    await run_task(task, client)
+    return ORJSONResponse(task.model_dump())
+
+# Task execution
+async def run_task(task: Task, client: httpx.AsyncClient) -> Task:
+    """Run a task's handler and record the result (or failure) on the task"""
     task.status = TaskStatus.IN_PROGRESS
     task.updated_at = datetime.now().isoformat()
     
     try:
         # Handle different task types
-        if task.type == "geocode":
-            result = await handle_geocode(task, client)
-        elif task.type == "reverse_geocode":
-            result = await handle_reverse_geocode(task, client)
-        elif task.type == "directions":
-            result = await handle_directions(task, client)
-        elif task.type == "places_search":
-            result = await handle_places_search(task, client)
-        elif task.type == "place_details":
-            result = await handle_place_details(task, client)
-        elif task.type == "distance_matrix":
-            result = await handle_distance_matrix(task, client)
-        else:
+        handler = TASK_HANDLERS.get(task.type)
+        if handler is None:
             raise HTTPException(status_code=400, detail=f"Unsupported task type: {task.type}")
+        result = await handler(task, client)
         
         # Update task with result
         task.output = result
         task.status = TaskStatus.COMPLETED
     except Exception as e:
         task.status = TaskStatus.FAILED
-        task.output = TaskOutput(
+        task.output = TaskOutput.model_construct(
             format=OutputFormat.TEXT,
             content=f"Error executing task: {str(e)}"
         )
@@ -217,6 +343,43 @@ async def execute_task(
     task.updated_at = datetime.now().isoformat()
     return task
 
+# Google Maps API requests
+async def cached_maps_get(
+    client: httpx.AsyncClient,
+    path: str,
+    params: Dict[str, Any]
+) -> Tuple[int, Dict[str, Any]]:
+    """GET a Google Maps endpoint, serving repeated lookups from maps_cache"""
+    # Task input values may be lists, so key on the query string httpx would
+    # send rather than on the (possibly unhashable) values themselves
+    key = (path, str(httpx.QueryParams(dict(sorted(params.items())))))
+    data = maps_cache.get(key)
+    if data is not None:
+        return 200, data
+    
+    inflight = maps_inflight.get(key)
+    if inflight is None:
+        inflight = asyncio.ensure_future(fetch_maps(client, path, params, key))
+        maps_inflight[key] = inflight
+        # Drop the entry once it settles; later misses start a fresh request
+        inflight.add_done_callback(lambda _: maps_inflight.pop(key, None))
+    # Shielded so one caller's cancellation doesn't cancel the others' request
+    return await asyncio.shield(inflight)
+
+async def fetch_maps(
+    client: httpx.AsyncClient,
+    path: str,
+    params: Dict[str, Any],
+    key: Tuple[str, str]
+) -> Tuple[int, Dict[str, Any]]:
+    """Make the upstream request for cached_maps_get and cache a successful result"""
+    response = await client.get(path, params=params)
+    data = orjson.loads(response.content)
+    # Only successful results are cached; errors are retried next time
+    if response.status_code == 200 and data.get("status") == "OK":
+        maps_cache[key] = data
+    return response.status_code, data
+
 # Task handlers for different Google Maps operations
 async def handle_geocode(task: Task, client: httpx.AsyncClient):
     """Handle geocode task - convert address to coordinates"""
@@ -225,10 +388,9 @@ async def handle_geocode(task: Task, client: httpx.AsyncClient):
     else:  # JSON
         address = task.input.content.get("address", "")
     
-    response = await client.get("/geocode/json", params={"address": address})
-    data = response.json()
+    status_code, data = await cached_maps_get(client, "/geocode/json", {"address": address})
     
-    if response.status_code != 200 or data.get("status") != "OK":
+    if status_code != 200 or data.get("status") != "OK":
         raise HTTPException(status_code=400, detail=f"Geocoding failed: {data.get('status')}")
     
     # Format the response based on requested output format
@@ -247,10 +409,10 @@ async def handle_geocode(task: Task, client: httpx.AsyncClient):
                 "place_id": result.get("place_id")
             }
         }
-        return TaskOutput(format=OutputFormat.GEOJSON, content=geojson)
+        return TaskOutput.model_construct(format=OutputFormat.GEOJSON, content=geojson)
     else:
         # Default JSON response
-        return TaskOutput(format=OutputFormat.JSON, content=data)
+        return TaskOutput.model_construct(format=OutputFormat.JSON, content=data)
 
 async def handle_reverse_geocode(task: Task, client: httpx.AsyncClient):
     """Handle reverse geocode task - convert coordinates to address"""
@@ -263,20 +425,27 @@ async def handle_reverse_geocode(task: Task, client: httpx.AsyncClient):
     if lat is None or lng is None:
         raise HTTPException(status_code=400, detail="Latitude and longitude required")
     
-    response = await client.get("/geocode/json", params={"latlng": f"{lat},{lng}"})
-    data = response.json()
+    status_code, data = await cached_maps_get(client, "/geocode/json", {"latlng": f"{lat},{lng}"})
     
-    if response.status_code != 200 or data.get("status") != "OK":
+    if status_code != 200 or data.get("status") != "OK":
         raise HTTPException(status_code=400, detail=f"Reverse geocoding failed: {data.get('status')}")
     
     # Format output based on requested format
     if task.output and task.output.format == OutputFormat.TEXT:
         result = data.get("results", [])[0]
         address = result.get("formatted_address", "Address not found")
-        return TaskOutput(format=OutputFormat.TEXT, content=address)
+        return TaskOutput.model_construct(format=OutputFormat.TEXT, content=address)
     else:
         # Default JSON response
-        return TaskOutput(format=OutputFormat.JSON, content=data)
+        return TaskOutput.model_construct(format=OutputFormat.JSON, content=data)
+
+# Markup Google Maps uses in step instructions, and its plain-text replacement
+HTML_TAG_RE = re.compile(r"</?b>|</?div>")
+HTML_TAG_REPLACEMENTS = {"<b>": "", "</b>": "", "<div>": ". ", "</div>": ""}
+
+def strip_instruction_html(html: str) -> str:
+    """Convert a step's html_instructions to plain text in a single pass"""
+    return HTML_TAG_RE.sub(lambda m: HTML_TAG_REPLACEMENTS[m.group(0)], html)
 
 async def handle_directions(task: Task, client: httpx.AsyncClient):
     """Handle directions task - get directions between locations"""
@@ -295,7 +464,7 @@ async def handle_directions(task: Task, client: httpx.AsyncClient):
         "destination": destination,
         "mode": mode
     })
-    data = response.json()
+    data = orjson.loads(response.content)
     
     if response.status_code != 200 or data.get("status") != "OK":
         raise HTTPException(status_code=400, detail=f"Directions failed: {data.get('status')}")
@@ -307,13 +476,13 @@ async def handle_directions(task: Task, client: httpx.AsyncClient):
         for route in data.get("routes", []):
             for leg in route.get("legs", []):
                 for i, step in enumerate(leg.get("steps", [])):
-                    steps.append(f"{i+1}. {step.get('html_instructions', '').replace('<b>', '').replace('</b>', '').replace('<div>', '. ').replace('</div>', '')}")
+                    steps.append(f"{i+1}. {strip_instruction_html(step.get('html_instructions', ''))}")
         
         text_directions = "\n".join(steps)
-        return TaskOutput(format=OutputFormat.TEXT, content=text_directions)
+        return TaskOutput.model_construct(format=OutputFormat.TEXT, content=text_directions)
     else:
-        # Default JSON response
-        return TaskOutput(format=OutputFormat.JSON, content=data)
+        # Default JSON response, passed through without re-encoding
+        return TaskOutput.model_construct(format=OutputFormat.JSON, content=orjson.Fragment(response.content))
 
 async def handle_places_search(task: Task, client: httpx.AsyncClient):
     """Handle places search task"""
@@ -331,7 +500,7 @@ async def handle_places_search(task: Task, client: httpx.AsyncClient):
             params["radius"] = radius
     
     response = await client.get("/place/textsearch/json", params=params)
-    data = response.json()
+    data = orjson.loads(response.content)
     
     if response.status_code != 200 or data.get("status") != "OK":
         raise HTTPException(status_code=400, detail=f"Places search failed: {data.get('status')}")
@@ -361,10 +530,10 @@ async def handle_places_search(task: Task, client: httpx.AsyncClient):
             "type": "FeatureCollection",
             "features": features
         }
-        return TaskOutput(format=OutputFormat.GEOJSON, content=geojson)
+        return TaskOutput.model_construct(format=OutputFormat.GEOJSON, content=geojson)
     else:
-        # Default JSON response
-        return TaskOutput(format=OutputFormat.JSON, content=data)
+        # Default JSON response, passed through without re-encoding
+        return TaskOutput.model_construct(format=OutputFormat.JSON, content=orjson.Fragment(response.content))
 
 async def handle_place_details(task: Task, client: httpx.AsyncClient):
     """Handle place details task"""
@@ -376,14 +545,13 @@ async def handle_place_details(task: Task, client: httpx.AsyncClient):
     if not place_id:
         raise HTTPException(status_code=400, detail="Place ID required")
     
-    response = await client.get("/place/details/json", params={"place_id": place_id})
-    data = response.json()
+    status_code, data = await cached_maps_get(client, "/place/details/json", {"place_id": place_id})
     
-    if response.status_code != 200 or data.get("status") != "OK":
+    if status_code != 200 or data.get("status") != "OK":
         raise HTTPException(status_code=400, detail=f"Place details failed: {data.get('status')}")
     
     # Only JSON output format supported for this task
-    return TaskOutput(format=OutputFormat.JSON, content=data)
+    return TaskOutput.model_construct(format=OutputFormat.JSON, content=data)
 
 async def handle_distance_matrix(task: Task, client: httpx.AsyncClient):
     """Handle distance matrix task"""
@@ -397,23 +565,34 @@ async def handle_distance_matrix(task: Task, client: httpx.AsyncClient):
     if not origins or not destinations:
         raise HTTPException(status_code=400, detail="Origins and destinations required")
     
-    # Format origins and destinations for the API
-    origins_str = "|".join(origins)
-    destinations_str = "|".join(destinations)
-    
+    # Format origins and destinations for the API; strings that are already
+    # pipe-separated are passed through unchanged
     response = await client.get("/distancematrix/json", params={
-        "origins": origins_str,
-        "destinations": destinations_str,
+        "origins": origins if isinstance(origins, str) else "|".join(origins),
+        "destinations": destinations if isinstance(destinations, str) else "|".join(destinations),
         "mode": mode
     })
-    data = response.json()
+    data = orjson.loads(response.content)
     
     if response.status_code != 200 or data.get("status") != "OK":
         raise HTTPException(status_code=400, detail=f"Distance matrix failed: {data.get('status')}")
     
     # Only JSON output format supported for this task
-    return TaskOutput(format=OutputFormat.JSON, content=data)
+    return TaskOutput.model_construct(format=OutputFormat.JSON, content=data)
+
+# Handler for each task type advertised in the agent card
+TASK_HANDLERS: Dict[str, Callable[[Task, httpx.AsyncClient], Awaitable[TaskOutput]]] = {
+    "geocode": handle_geocode,
+    "reverse_geocode": handle_reverse_geocode,
+    "directions": handle_directions,
+    "places_search": handle_places_search,
+    "place_details": handle_place_details,
+    "distance_matrix": handle_distance_matrix
+}
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # Tasks and caches are per-process, so a single worker is the default;
+    # uvloop and httptools from uvicorn[standard] are picked up automatically
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=workers)
\ No newline at end of file
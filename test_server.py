@@ -1,8 +1,8 @@
 import os
 import pytest
-from fastapi.testclient import TestClient
-from unittest.mock import patch, AsyncMock
-import json
+import httpx
+import orjson
+import respx
 import uuid
 from datetime import datetime
 
@@ -10,108 +10,211 @@ from datetime import datetime
 os.environ["API_KEY"] = "test_api_key"
 os.environ["GOOGLE_MAPS_API_KEY"] = "test_google_maps_api_key"
 
-# Import the app after setting environment variables
-from main import app, verify_api_key, API_KEY
-
 TEST_API_KEY = "test_api_key"
+# Shared by every authenticated request; httpx copies it into its own headers
+AUTH_HEADERS = {"X-API-Key": TEST_API_KEY}
+
+# Geocode task payload shared by the tests; each test sets its own id and
+# overrides other fields as needed
+NOW = datetime.now().isoformat()
+TASK_TEMPLATE = {
+    "type": "geocode",
+    "status": "created",
+    "created_at": NOW,
+    "updated_at": NOW,
+    "input": {
+        "format": "text",
+        "content": "1600 Amphitheatre Parkway, Mountain View, CA"
+    }
+}
+
+# Import the server lazily, once per session, so collecting tests doesn't
+# build the app; the environment above is already set by then
+@pytest.fixture(scope="session")
+def main():
+    import main as main_module
+    return main_module
 
-# Create test client
-client = TestClient(app)
+@pytest.fixture(scope="session")
+def app(main):
+    return main.app
+
+# Create one async test client for the whole session. ASGITransport calls the
+# app in-process on the test's event loop but doesn't run the lifespan, so
+# it is entered here to open the shared Google Maps client
+@pytest.fixture(scope="session")
+async def client(app):
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as c:
+            yield c
 
 # Mock the dependency for authentication
-@pytest.fixture(autouse=True)
-def override_dependency():
-    app.dependency_overrides[verify_api_key] = lambda: TEST_API_KEY
+@pytest.fixture(scope="session", autouse=True)
+def override_dependency(main, app):
+    app.dependency_overrides[main.verify_api_key] = lambda: TEST_API_KEY
     yield
     app.dependency_overrides = {}
 
-# Mock Google Maps API calls
+# Keep cached Google Maps lookups from leaking between tests
+@pytest.fixture(autouse=True)
+def clear_maps_cache(main):
+    yield
+    main.maps_cache.clear()
+
+# Google Maps geocode response served by the HTTP mock, serialized once per session
+@pytest.fixture(scope="session")
+def geocode_response_bytes():
+    return orjson.dumps({
+        "status": "OK",
+        "results": [
+            {
+                "formatted_address": "1600 Amphitheatre Pkwy, Mountain View, CA 94043, USA",
+                "geometry": {
+                    "location": {
+                        "lat": 37.4224764,
+                        "lng": -122.0842499
+                    }
+                },
+                "place_id": "ChIJ2eUgeAK6j4ARbn5u_wAGqWA"
+            }
+        ]
+    })
+
+# Mock Google Maps API calls at the transport level; tests register the
+# routes they expect and the app's real httpx client hits them
 @pytest.fixture
-def mock_httpx_get():
-    with patch("httpx.AsyncClient.get") as mock_get:
-        mock_response = AsyncMock()
-        mock_response.status_code = 200
-        mock_response.json.return_value = {
-            "status": "OK",
-            "results": [
-                {
-                    "formatted_address": "1600 Amphitheatre Pkwy, Mountain View, CA 94043, USA",
-                    "geometry": {
-                        "location": {
-                            "lat": 37.4224764,
-                            "lng": -122.0842499
-                        }
-                    },
-                    "place_id": "ChIJ2eUgeAK6j4ARbn5u_wAGqWA"
-                }
-            ]
-        }
-        mock_get.return_value = mock_response
-        yield mock_get
+def maps_mock():
+    with respx.mock(base_url="https://maps.googleapis.com/maps/api") as respx_mock:
+        yield respx_mock
+
+# A fresh task ID per test, in the server's own hex format
+@pytest.fixture
+def task_id():
+    return uuid.uuid4().hex
+
+# A geocode task created once per module, returned as (task_id, created task
+# JSON); tests check the creation response, read the task or execute it
+@pytest.fixture(scope="module")
+async def geocode_task(client):
+    task_id = uuid.uuid4().hex
+    task_data = {**TASK_TEMPLATE, "id": task_id}
+    
+    response = await client.post(
+        "/tasks", 
+        json=task_data,
+        headers=AUTH_HEADERS
+    )
+    return task_id, response.json()
 
-def test_root():
-    response = client.get("/")
+async def test_root(client):
+    response = await client.get("/")
     assert response.status_code == 200
-    assert "message" in response.json()
-    assert "version" in response.json()
+    body = response.json()
+    assert "message" in body
+    assert "version" in body
 
-def test_get_agent_card():
-    response = client.get("/agent-card")
+async def test_get_agent_card(client):
+    response = await client.get("/agent-card")
     assert response.status_code == 200
     agent_card = response.json()
     assert agent_card["name"] == "Google Maps A2A"
     assert len(agent_card["tasks"]) > 0
 
-def test_create_task():
+async def test_large_responses_are_gzipped(client):
+    response = await client.get("/agent-card", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    # The gzipped bytes differ from the plain body, so the tag can only be weak
+    assert response.headers["ETag"].startswith('W/"')
+    assert response.json()["name"] == "Google Maps A2A"
+
+async def test_get_agent_card_not_modified(client):
+    response = await client.get("/agent-card")
+    etag = response.headers["ETag"]
+    response = await client.get("/agent-card", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert response.content == b""
+
+def test_create_task(geocode_task):
+    task_id, created_task = geocode_task
+    assert created_task["id"] == task_id
+    assert created_task["type"] == "geocode"
+    assert created_task["status"] == "created"
+
+async def test_create_task_invalid_input_format(client):
     task_data = {
-        "id": str(uuid.uuid4()),
         "type": "geocode",
-        "status": "created",
-        "created_at": datetime.now().isoformat(),
-        "updated_at": datetime.now().isoformat(),
         "input": {
-            "format": "text",
+            "format": "image/png",
             "content": "1600 Amphitheatre Parkway, Mountain View, CA"
         }
     }
     
-    response = client.post(
+    response = await client.post(
         "/tasks", 
         json=task_data,
-        headers={"X-API-Key": TEST_API_KEY}
+        headers=AUTH_HEADERS
     )
     
-    assert response.status_code == 200
-    created_task = response.json()
-    assert created_task["id"] == task_data["id"]
-    assert created_task["type"] == "geocode"
-    assert created_task["status"] == "created"
+    assert response.status_code == 422
+    assert response.json()["detail"][0]["loc"] == ["body", "input", "format"]
 
-def test_get_task():
-    # First create a task
-    task_id = str(uuid.uuid4())
-    task_data = {
-        "id": task_id,
-        "type": "geocode",
-        "status": "created",
-        "created_at": datetime.now().isoformat(),
-        "updated_at": datetime.now().isoformat(),
-        "input": {
-            "format": "text",
-            "content": "1600 Amphitheatre Parkway, Mountain View, CA"
-        }
-    }
+async def test_create_task_missing_input_content(client, task_id):
+    task_data = {**TASK_TEMPLATE, "id": task_id, "input": {"format": "text"}}
+    
+    response = await client.post(
+        "/tasks", 
+        json=task_data,
+        headers=AUTH_HEADERS
+    )
     
-    client.post(
+    assert response.status_code == 422
+    error = response.json()["detail"][0]
+    assert error["loc"] == ["body", "input", "content"]
+    assert error["type"] == "missing"
+
+def test_body_validation_errors_drop_undefined_input(main):
+    error = main.ValidationError.from_exception_data(
+        "Task", [{"type": "missing", "loc": ("input",), "input": main.PydanticUndefined}]
+    )
+    assert main.body_validation_errors(error) == [
+        {"type": "missing", "loc": ["body", "input"], "msg": "Field required"}
+    ]
+
+async def test_create_task_invalid_status_without_updated_at(client, task_id):
+    task_data = {**TASK_TEMPLATE, "id": task_id, "status": "bogus"}
+    del task_data["updated_at"]
+    
+    response = await client.post(
         "/tasks", 
         json=task_data,
-        headers={"X-API-Key": TEST_API_KEY}
+        headers=AUTH_HEADERS
     )
     
-    # Now retrieve it
-    response = client.get(
+    assert response.status_code == 422
+
+@pytest.mark.parametrize("omit", [True, False], ids=["omitted", "null"])
+async def test_create_task_defaults_updated_at_to_created_at(client, task_id, omit):
+    task_data = {**TASK_TEMPLATE, "id": task_id, "updated_at": None}
+    del task_data["created_at"]
+    if omit:
+        del task_data["updated_at"]
+    
+    response = await client.post(
+        "/tasks", 
+        json=task_data,
+        headers=AUTH_HEADERS
+    )
+    
+    task = response.json()
+    assert task["updated_at"] == task["created_at"]
+
+async def test_get_task(client, geocode_task):
+    task_id, _ = geocode_task
+    response = await client.get(
         f"/tasks/{task_id}",
-        headers={"X-API-Key": TEST_API_KEY}
+        headers=AUTH_HEADERS
     )
     
     assert response.status_code == 200
@@ -119,63 +222,215 @@ def test_get_task():
     assert task["id"] == task_id
     assert task["type"] == "geocode"
 
-@pytest.mark.asyncio
-async def test_execute_geocode_task(mock_httpx_get):
-    # Create a task
-    task_id = str(uuid.uuid4())
+async def test_execute_geocode_task(client, maps_mock, geocode_response_bytes, geocode_task):
+    task_id, _ = geocode_task
+    maps_mock.get("/geocode/json").respond(200, content=geocode_response_bytes)
+    
+    # Execute the task
+    response = await client.put(
+        f"/tasks/{task_id}/execute",
+        headers=AUTH_HEADERS
+    )
+    
+    assert response.status_code == 200
+    result = response.json()
+    assert result["id"] == task_id
+    assert result["status"] == "completed"
+    assert result["output"]["content"]["results"][0]["place_id"] == "ChIJ2eUgeAK6j4ARbn5u_wAGqWA"
+
+async def test_batch_execute_tasks(client, maps_mock, geocode_response_bytes):
+    maps_mock.get("/geocode/json").respond(200, content=geocode_response_bytes)
+    task_ids = [uuid.uuid4().hex, uuid.uuid4().hex]
+    for task_id in task_ids:
+        task_data = {**TASK_TEMPLATE, "id": task_id}
+        await client.post(
+            "/tasks", 
+            json=task_data,
+            headers=AUTH_HEADERS
+        )
+    
+    response = await client.put(
+        "/tasks/batch-execute",
+        json=task_ids,
+        headers=AUTH_HEADERS
+    )
+    
+    assert response.status_code == 200
+    assert [task["id"] for task in response.json()] == task_ids
+    
+    # Unknown IDs are rejected before anything runs
+    response = await client.put(
+        "/tasks/batch-execute",
+        json=[task_ids[0], "missing-task"],
+        headers=AUTH_HEADERS
+    )
+    assert response.status_code == 404
+
+async def test_batch_execute_rejects_oversized_batch(client, main):
+    task_ids = [uuid.uuid4().hex for _ in range(main.BATCH_EXECUTE_MAX_TASKS + 1)]
+    response = await client.put(
+        "/tasks/batch-execute",
+        json=task_ids,
+        headers=AUTH_HEADERS
+    )
+    
+    assert response.status_code == 422
+
+async def test_geocode_results_are_cached(client, maps_mock, geocode_response_bytes):
+    route = maps_mock.get("/geocode/json").respond(200, content=geocode_response_bytes)
+    task_ids = [uuid.uuid4().hex, uuid.uuid4().hex]
+    for task_id in task_ids:
+        task_data = {**TASK_TEMPLATE, "id": task_id}
+        await client.post(
+            "/tasks", 
+            json=task_data,
+            headers=AUTH_HEADERS
+        )
+        response = await client.put(
+            f"/tasks/{task_id}/execute",
+            headers=AUTH_HEADERS
+        )
+        assert response.json()["status"] == "completed"
+
+    # The second identical lookup is answered from the cache
+    assert route.call_count == 1
+
+async def test_concurrent_failed_lookups_share_one_request(client, maps_mock):
+    route = maps_mock.get("/geocode/json").respond(200, json={"status": "ZERO_RESULTS", "results": []})
+    task_ids = [uuid.uuid4().hex for _ in range(3)]
+    for task_id in task_ids:
+        await client.post(
+            "/tasks",
+            json={**TASK_TEMPLATE, "id": task_id},
+            headers=AUTH_HEADERS
+        )
+    response = await client.put(
+        "/tasks/batch-execute",
+        json=task_ids,
+        headers=AUTH_HEADERS
+    )
+
+    assert [task["status"] for task in response.json()] == ["failed"] * 3
+    # Failures aren't cached, but identical lookups in flight together still
+    # make one upstream call
+    assert route.call_count == 1
+
+async def test_geocode_accepts_list_address(client, maps_mock, geocode_response_bytes, task_id):
+    route = maps_mock.get("/geocode/json").respond(200, content=geocode_response_bytes)
     task_data = {
+        **TASK_TEMPLATE,
         "id": task_id,
-        "type": "geocode",
-        "status": "created",
-        "created_at": datetime.now().isoformat(),
-        "updated_at": datetime.now().isoformat(),
         "input": {
-            "format": "text",
-            "content": "1600 Amphitheatre Parkway, Mountain View, CA"
+            "format": "application/json",
+            "content": {"address": ["1600 Amphitheatre Parkway", "Mountain View, CA"]}
         }
     }
     
-    client.post(
+    await client.post(
         "/tasks", 
         json=task_data,
-        headers={"X-API-Key": TEST_API_KEY}
+        headers=AUTH_HEADERS
     )
+    response = await client.put(
+        f"/tasks/{task_id}/execute",
+        headers=AUTH_HEADERS
+    )
+
+    assert response.json()["status"] == "completed"
+    # The list is still sent as repeated query params
+    params = route.calls.last.request.url.params
+    assert params.get_list("address") == ["1600 Amphitheatre Parkway", "Mountain View, CA"]
+
+async def test_execute_directions_task_passes_json_through(client, main, maps_mock, geocode_response_bytes, task_id):
+    maps_mock.get("/directions/json").respond(200, content=geocode_response_bytes)
+    task_data = {
+        **TASK_TEMPLATE,
+        "id": task_id,
+        "type": "directions",
+        "input": {
+            "format": "application/json",
+            "content": {
+                "origin": "San Francisco, CA",
+                "destination": "Mountain View, CA"
+            }
+        }
+    }
     
-    # Set up the HTTP mocking to bypass the real Google Maps API
-    with patch("main.google_maps_client"):
-        # Execute the task
-        response = client.put(
-            f"/tasks/{task_id}/execute",
-            headers={"X-API-Key": TEST_API_KEY}
-        )
-    
-    # Skip the detailed assertion for now since we're mocking
-    assert response.status_code == 200
-    # Simplified test - just check the task was processed in some way
+    await client.post(
+        "/tasks", 
+        json=task_data,
+        headers=AUTH_HEADERS
+    )
+    response = await client.put(
+        f"/tasks/{task_id}/execute",
+        headers=AUTH_HEADERS
+    )
+
     result = response.json()
-    assert result["id"] == task_id
-    assert "status" in result
+    assert result["status"] == "completed"
+    assert result["output"]["format"] == "application/json"
+    assert result["output"]["content"] == orjson.loads(geocode_response_bytes)
+    
+    # The stored task still serves the passed-through JSON, through the
+    # endpoint and through pydantic's own JSON serialization
+    response = await client.get(f"/tasks/{task_id}", headers=AUTH_HEADERS)
+    assert response.json() == result
+    assert orjson.loads(main.tasks_db[task_id].model_dump_json()) == result
 
-def test_execute_unsupported_task():
-    # Create a task with unsupported type
+async def test_execute_distance_matrix_accepts_joined_locations(client, maps_mock, geocode_response_bytes, task_id):
+    route = maps_mock.get("/distancematrix/json").respond(200, content=geocode_response_bytes)
     task_data = {
-        "id": str(uuid.uuid4()),
-        "type": "unsupported_task",
-        "status": "created",
-        "created_at": datetime.now().isoformat(),
-        "updated_at": datetime.now().isoformat(),
+        **TASK_TEMPLATE,
+        "id": task_id,
+        "type": "distance_matrix",
         "input": {
-            "format": "text",
-            "content": "test content"
+            "format": "application/json",
+            "content": {
+                "origins": "San Francisco, CA|Oakland, CA",
+                "destinations": ["Mountain View, CA", "San Jose, CA"]
+            }
         }
     }
     
+    await client.post(
+        "/tasks", 
+        json=task_data,
+        headers=AUTH_HEADERS
+    )
+    await client.put(
+        f"/tasks/{task_id}/execute",
+        headers=AUTH_HEADERS
+    )
+
+    params = route.calls.last.request.url.params
+    assert params["origins"] == "San Francisco, CA|Oakland, CA"
+    assert params["destinations"] == "Mountain View, CA|San Jose, CA"
+
+def test_strip_instruction_html(main):
+    html = "Turn <b>left</b> onto <b>Main St</b><div>Destination will be on the right</div>"
+    assert main.strip_instruction_html(html) == "Turn left onto Main St. Destination will be on the right"
+
+async def test_execute_unsupported_task(client, task_id):
+    # Create a task with unsupported type
+    task_data = {**TASK_TEMPLATE, "id": task_id, "type": "unsupported_task"}
+    
     # Should fail with 400 Bad Request
-    response = client.post(
+    response = await client.post(
         "/tasks", 
         json=task_data,
-        headers={"X-API-Key": TEST_API_KEY}
+        headers=AUTH_HEADERS
     )
     
     assert response.status_code == 400
-    assert "Unsupported task type" in response.json()["detail"]
\ No newline at end of file
+    assert "Unsupported task type" in response.json()["detail"]
+
+def test_validate_supported_task_types(main):
+    for task in main.AGENT_CARD["tasks"]:
+        main.validate_task_type(task["type"])
+
+@pytest.mark.parametrize("task_type", ["unsupported_task", "", "Geocode"])
+def test_validate_unsupported_task_type(main, task_type):
+    with pytest.raises(main.HTTPException) as e:
+        main.validate_task_type(task_type)
+    assert e.value.status_code == 400
+    assert "Unsupported task type" in e.value.detail
\ No newline at end of file